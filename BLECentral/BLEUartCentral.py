@@ -6,13 +6,23 @@
 _TARGET_PERIPHERAL_NAME = "ID000001"
 _NBCHAR = const(8)
 
+# set to 1 for verbose BLE event tracing; with const(0) the compiler folds
+# the gated prints (and their string/hexlify allocations) out entirely
+_DEBUG = const(0)
+
+# prefix compared against advertised names, sliced once here instead of on
+# every scan result
+_TARGET_PREFIX = _TARGET_PERIPHERAL_NAME[:_NBCHAR]
+
 import bluetooth # BLE lib
-from ble_advertising import decode_services, decode_name # to decode received msg
+from ble_advertising import decode_name # to decode received msg
 from binascii import hexlify
 import ubinascii
 import pyb
 import machine
+import struct
 import time
+import uasyncio as asyncio
 
 _CONNECTION_INTERVAL_SEC = 15
 
@@ -30,8 +40,6 @@ _IRQ_SCAN_RESULT = const(5)
 _IRQ_SCAN_DONE = const(6)
 _IRQ_advertising_payload_CONNECT = const(7)
 _IRQ_advertising_payload_DISCONNECT = const(8)
-_IRQ_GATTC_SERVICE_RESULT = const(9)
-_IRQ_GATTC_SERVICE_DONE = const(10)
 _IRQ_GATTC_CHARACTERISTIC_RESULT = const(11)
 _IRQ_GATTC_CHARACTERISTIC_DONE = const(12)
 _IRQ_GATTC_WRITE_DONE = const(17)
@@ -43,12 +51,23 @@ _ADV_IND = const(0x00)
 _ADV_DIRECT_IND = const(0x01)
 
 # parameters for scanning cycle
+# 30 ms window every 100 ms: a 100%-duty scan (interval == window) keeps the
+# radio on continuously and starves coexisting traffic for no extra benefit
 _SCAN_DURATION_MS = const(30000)
-_SCAN_INTERVAL_US = const(30000)
+_SCAN_INTERVAL_US = const(100000)
 _SCAN_WINDOW_US = const(30000)
 
+# connection interval negotiated at gap_connect (us): short interval for low
+# notify latency between the 5 s samples
+_CONN_INTERVAL_MIN_US = const(7500)
+_CONN_INTERVAL_MAX_US = const(15000)
+
 # definition of Uart services
-_UART_SERVICE_UUID = bluetooth.UUID("6E400001-B5A3-F393-E0A9-E50E24DCCA9E")
+# the service UUID (6E400001-B5A3-F393-E0A9-E50E24DCCA9E) as raw
+# little-endian bytes, exactly as it appears in an advertising payload:
+# matching this substring is far cheaper than parsing the payload into a
+# list of UUID objects on every scan result
+_UART_UUID_LE = b'\x9e\xca\xdc\x24\x0e\xe5\xa9\xe0\x93\xf3\xa3\xb5\x01\x00\x40\x6e'
 _UART_RX_CHAR_UUID = bluetooth.UUID("6E400002-B5A3-F393-E0A9-E50E24DCCA9E")
 _UART_TX_CHAR_UUID = bluetooth.UUID("6E400003-B5A3-F393-E0A9-E50E24DCCA9E")
 
@@ -56,9 +75,20 @@ _UART_TX_CHAR_UUID = bluetooth.UUID("6E400003-B5A3-F393-E0A9-E50E24DCCA9E")
 MAC_address = 0 # Peripheral's MAC addr
 My_MAC = "c190701061"
 
+# acknowledgment sent back after every notification, encoded once at import
+# instead of rebuilding the string on every receipt
+_ACK_MSG = ("ack from Central " + My_MAC).encode()
+
 # max bytes for messages
 _MAX_NB_BYTES = const(128)
 
+# polling period (ms) while waiting for a connection state change
+_T_WAIT = const(100)
+
+# header byte of the Peripheral's binary sample frame:
+# <header, temp(int8), humi(uint8), illum(uint8)>
+_FRAME_SAMPLE = const(0x01)
+
 # Class to generate the BLE Central
 class BLECentral:
 
@@ -66,8 +96,29 @@ class BLECentral:
     def __init__(self, ble):
         self._ble = ble
         self._ble.active(True)
+
+        # event-code -> bound handler table, built once: _irq resolves each
+        # event with a single dict lookup instead of an if/elif chain
+        self._dispatch = {
+            _IRQ_SCAN_RESULT: self._on_scan_result,
+            _IRQ_SCAN_DONE: self._on_scan_done,
+            _IRQ_advertising_payload_CONNECT: self._on_connect,
+            _IRQ_advertising_payload_DISCONNECT: self._on_disconnect,
+            _IRQ_GATTC_CHARACTERISTIC_RESULT: self._on_characteristic_result,
+            _IRQ_GATTC_CHARACTERISTIC_DONE: self._on_characteristic_done,
+            _IRQ_GATTC_WRITE_DONE: self._on_write_done,
+            _IRQ_GATTC_NOTIFY: self._on_notify,
+            _IRQ_MTU_EXCHANGED: self._on_mtu_exchanged,
+        }
+
         self._ble.irq(self._irq)
         self._ble.config(mtu=_MAX_NB_BYTES)
+
+        # discovered GATT handles per peripheral address, so a reconnection
+        # to a known device can skip service/characteristic discovery
+        # (kept out of _reset() on purpose: it must survive disconnections)
+        self._handle_cache = {}
+
         self._reset()
         
         # to view the MAC addr
@@ -92,108 +143,122 @@ class BLECentral:
 
         # addresses and characteristics of the connected Peripheral
         self._conn_handle = None
-        self._start_handle = None
-        self._end_handle = None
         self._tx_handle = None
         self._rx_handle = None
 
-    # handling interrupts event
+    # handling interrupts event: one dict lookup routes the event to its
+    # handler, so frequent events (notify) no longer pay for the whole chain
     def _irq(self, event, data):
+        handler = self._dispatch.get(event)
+        if handler:
+            handler(data)
 
-        # event: scanned device
-        if event == _IRQ_SCAN_RESULT:
-        
-            # read the content of advertising frames
-            addr_type, addr, adv_type, rssi, adv_data = data
+    # event: scanned device
+    def _on_scan_result(self, data):
 
-            # if the advertising reports a device offering a Uart service
-            if adv_type in (_ADV_IND, _ADV_DIRECT_IND) and _UART_SERVICE_UUID in decode_services(adv_data):
-            
-                # if this is the Peripheral device, reference it and stop scanning
-                self._name = decode_name(adv_data) or "?"
-                if self._name[0:_NBCHAR] == _TARGET_PERIPHERAL_NAME[0:_NBCHAR]:
-                    self._addr_type = addr_type
-                    self._addr = bytes(addr) # Note: le tampon addr a pour propriétaire l'appelant, donc il faut le copier.
-                    self._name = decode_name(adv_data) or "?"
-                    self._ble.gap_scan(None)
-
-        # event: scan terminated
-        elif event == _IRQ_SCAN_DONE:
-            if self._scan_callback:
-                if self._addr:
-                    # the Peripheral has been detected
-                    self._scan_callback(self._addr_type, self._addr, self._name)
-                    self._scan_callback = None
-                    print("Scan terminated, success : Peripheral %s found" %_TARGET_PERIPHERAL_NAME)
-                else:
-                    # the scan exceeded its "time-out" period before to find Peripheral device
-                    self._scan_callback(None, None, None)
-                    print("Scan terminated, failure : %s didn't found Peripheral %s s" %(_TARGET_PERIPHERAL_NAME,_SCAN_DURATION_MS/1000))
+        # read the content of advertising frames
+        addr_type, addr, adv_type, rssi, adv_data = data
 
-        # event: connection estabilished
-        elif event == _IRQ_advertising_payload_CONNECT:
-            conn_handle, addr_type, addr = data
-            if addr_type == self._addr_type and addr == self._addr:
-                self._conn_handle = conn_handle
-                self._ble.gattc_exchange_mtu(self._conn_handle)
-                self._ble.gattc_discover_services(self._conn_handle)
-            b = bytes(addr)
-            print("Connected with peripheral %s" %hexlify(b).decode("ascii"))
-
-
-        # event: disconnection
-        elif event == _IRQ_advertising_payload_DISCONNECT:
-            conn_handle, addr_type, addr = data
-            if conn_handle == self._conn_handle:
-                self._reset()
-            print("Disconnected from Peripheral with MAC addr {}...".format(hexlify(addr)))   
-
-
-        # event: service notified from Peripheral to Central
-        elif event == _IRQ_GATTC_SERVICE_RESULT:
-            conn_handle, start_handle, end_handle, uuid = data
-            if conn_handle == self._conn_handle and uuid == _UART_SERVICE_UUID:
-                self._start_handle, self._end_handle = start_handle, end_handle
-
-        # event: search of services terminated
-        elif event == _IRQ_GATTC_SERVICE_DONE:
-            if self._start_handle and self._end_handle:
-                self._ble.gattc_discover_characteristics(
-                    self._conn_handle, self._start_handle, self._end_handle
-                )
-            else:
-                print("Uart service is unreachable.")
+        # skip non-connectable adverts before any payload parsing
+        if adv_type not in (_ADV_IND, _ADV_DIRECT_IND):
+            return
 
-        # event: characteristic notified from Peripheral to Central
-        elif event == _IRQ_GATTC_CHARACTERISTIC_RESULT:
-            conn_handle, def_handle, value_handle, properties, uuid = data
-            if conn_handle == self._conn_handle and uuid == _UART_RX_CHAR_UUID:
-                self._rx_handle = value_handle
-            if conn_handle == self._conn_handle and uuid == _UART_TX_CHAR_UUID:
-                self._tx_handle = value_handle
+        # if the advertising reports a device offering a Uart service
+        # (single substring search over the raw payload)
+        if _UART_UUID_LE in bytes(adv_data):
+
+            # if this is the Peripheral device, reference it and stop scanning
+            # (decode the name once; startswith avoids the slice copies)
+            name = decode_name(adv_data)
+            if name and name.startswith(_TARGET_PREFIX):
+                self._name = name
+                self._addr_type = addr_type
+                self._addr = bytes(addr) # Note: le tampon addr a pour propriétaire l'appelant, donc il faut le copier.
+                self._ble.gap_scan(None)
+
+    # event: scan terminated
+    def _on_scan_done(self, data):
+        if self._scan_callback:
+            if self._addr:
+                # the Peripheral has been detected
+                self._scan_callback(self._addr_type, self._addr, self._name)
+                self._scan_callback = None
+                if _DEBUG:
+                    print("Scan terminated, success : Peripheral %s found" %_TARGET_PERIPHERAL_NAME)
+            else:
+                # the scan exceeded its "time-out" period before to find Peripheral device
+                self._scan_callback(None, None, None)
+                if _DEBUG:
+                    print("Scan terminated, failure : %s didn't found Peripheral %s s" %(_TARGET_PERIPHERAL_NAME,_SCAN_DURATION_MS/1000))
 
-        # event: search of characteristics terminated
-        elif event == _IRQ_GATTC_CHARACTERISTIC_DONE:
-            if self._tx_handle is not None and self._rx_handle is not None:
+    # event: connection estabilished
+    def _on_connect(self, data):
+        conn_handle, addr_type, addr = data
+        if addr_type == self._addr_type and addr == self._addr:
+            self._conn_handle = conn_handle
+            ble = self._ble
+            ble.gattc_exchange_mtu(conn_handle)
+            cached = self._handle_cache.get(bytes(self._addr))
+            if cached:
+                # handles already known from a previous connection:
+                # skip the discovery round-trip entirely
+                self._tx_handle, self._rx_handle = cached
                 if self._conn_callback:
                     self._conn_callback()
             else:
-                print("Uart characteristic RX not discoverable.")
+                # the RX/TX characteristic UUIDs are fixed and known, so
+                # skip service discovery and walk the whole handle range in
+                # one request, filtering by UUID in the result handler
+                ble.gattc_discover_characteristics(conn_handle, 1, 0xFFFF)
+        if _DEBUG:
+            print("Connected with peripheral %s" %hexlify(bytes(addr)).decode("ascii"))
+
+    # event: disconnection
+    def _on_disconnect(self, data):
+        conn_handle, addr_type, addr = data
+        if conn_handle == self._conn_handle:
+            self._reset()
+        if _DEBUG:
+            print("Disconnected from Peripheral with MAC addr {}...".format(hexlify(addr)))
+
+    # event: characteristic notified from Peripheral to Central
+    def _on_characteristic_result(self, data):
+        conn_handle, def_handle, value_handle, properties, uuid = data
+        if conn_handle == self._conn_handle:
+            if uuid == _UART_RX_CHAR_UUID:
+                self._rx_handle = value_handle
+            elif uuid == _UART_TX_CHAR_UUID:
+                self._tx_handle = value_handle
 
-        # event: device acknowledgment
-        elif event == _IRQ_GATTC_WRITE_DONE:
+    # event: search of characteristics terminated
+    def _on_characteristic_done(self, data):
+        if self._tx_handle is not None and self._rx_handle is not None:
+            # remember the handles for the next connection to this peripheral
+            self._handle_cache[bytes(self._addr)] = (
+                self._tx_handle,
+                self._rx_handle,
+            )
+            if self._conn_callback:
+                self._conn_callback()
+        elif _DEBUG:
+            print("Uart characteristic RX not discoverable.")
+
+    # event: device acknowledgment
+    def _on_write_done(self, data):
+        if _DEBUG:
             conn_handle, value_handle, status = data
             print("writing in RX done")
 
-        # event: device notification response
-        elif event == _IRQ_GATTC_NOTIFY:
-            conn_handle, value_handle, notify_data = data
-            if conn_handle == self._conn_handle and value_handle == self._tx_handle:
-                if self._notify_callback:
-                    self._notify_callback(notify_data)
+    # event: device notification response
+    def _on_notify(self, data):
+        conn_handle, value_handle, notify_data = data
+        if conn_handle == self._conn_handle and value_handle == self._tx_handle:
+            if self._notify_callback:
+                self._notify_callback(notify_data)
 
-        # event: payload size changed
-        elif event == _IRQ_MTU_EXCHANGED:
+    # event: payload size changed
+    def _on_mtu_exchanged(self, data):
+        if _DEBUG:
             print("The maximum message size is now " + str(_MAX_NB_BYTES) + " bytes")
 
     # returns true if there is a connection to the Uart service
@@ -204,6 +269,25 @@ class BLECentral:
             and self._rx_handle is not None
         )
 
+    def wait_for_connection(self, status, timeout_ms):
+        """
+        Wait until the connection state matches `status` or the timeout expires.
+
+        Parameters:
+            status (bool):    desired state (True = connected, False = disconnected)
+            timeout_ms (int): maximum time to wait, in milliseconds
+
+        Returns:
+            bool: True  as soon as is_connected() matches `status`,
+                  False if the timeout expired first
+        """
+        t0 = time.ticks_ms()
+        while time.ticks_diff(time.ticks_ms(), t0) < timeout_ms:
+            if self.is_connected() == status:
+                return True
+            time.sleep_ms(_T_WAIT)
+        return False
+
     def scan(self, callback=None):
         """
         Find all available devices.
@@ -218,7 +302,9 @@ class BLECentral:
         self._addr = None
         self._scan_callback = callback
         try:
-            self._ble.gap_scan(2000, 30000, 30000, True)
+            # passive scan: the peripheral's name and service UUID are both in
+            # the advertising payload, so scan responses are not needed
+            self._ble.gap_scan(2000, _SCAN_INTERVAL_US, _SCAN_WINDOW_US, False)
         except OSError:
             pass
 
@@ -247,7 +333,13 @@ class BLECentral:
         if self._addr_type is None or self._addr is None:
             return False
         try:
-            self._ble.gap_connect(self._addr_type, self._addr)
+            self._ble.gap_connect(
+                self._addr_type,
+                self._addr,
+                2000,
+                _CONN_INTERVAL_MIN_US,
+                _CONN_INTERVAL_MAX_US,
+            )
         except OSError:
             pass
         return True
@@ -267,12 +359,17 @@ class BLECentral:
         self._reset()
 
     # send data to Uart
-    # this method allows the Central to send a message to the Peripheral
+    # this method allows the Central to send a message to the Peripheral;
+    # bytes/bytearray/memoryview are handed to the stack as-is, only a str
+    # pays for an encode
     def write(self, v, response = False):
-        
+
         if not self.is_connected():
             return
 
+        if isinstance(v, str):
+            v = v.encode()
+
         self._ble.gattc_write(self._conn_handle, self._rx_handle, v, 1 if response else 0)
         
         # confirm that the ack has been sent
@@ -291,14 +388,18 @@ def on_receipt(v):
     # conversion to bytes
     b = bytes(v)
 
-    # convert the received bytes into characters coded in UTF-8 format
-    payload = b.decode('utf-8')
-
-    print("received message from Peripheral with MAC addr " + str(MAC_address) + " : ", payload)
+    # samples arrive as a compact 4-byte binary frame; everything else
+    # (LED state changes) is still plain text
+    if len(b) == 4 and b[0] == _FRAME_SAMPLE:
+        temp, humi, illum = struct.unpack_from('<bBB', b, 1)
+        print("received sample from Peripheral with MAC addr " + str(MAC_address) + " : %d °C, %d %%, %d lux" % (temp, humi, illum))
+    else:
+        # convert the received bytes into characters coded in UTF-8 format
+        payload = b.decode('utf-8')
+        print("received message from Peripheral with MAC addr " + str(MAC_address) + " : ", payload)
 
     try:
-        v = "ack from Central " + My_MAC
-        central.write(v)
+        central.write(_ACK_MSG)
     except:
         print("Failed to send response from Central")
 
@@ -308,56 +409,71 @@ ble = bluetooth.BLE()
 central = BLECentral(ble)
 
 
+# wait (in task context) until the connection state matches status, like
+# wait_for_connection but yielding to other tasks instead of sleeping
+async def _wait_for_state(status, timeout_ms):
+    t0 = time.ticks_ms()
+    while time.ticks_diff(time.ticks_ms(), t0) < timeout_ms:
+        if central.is_connected() == status:
+            return True
+        await asyncio.sleep_ms(_T_WAIT)
+    return False
+
+
 ########### MAIN PROGRAM ###########
-def demo():
+async def main():
+
+    # button SW1 on the Central board, configured once
+    sw1 = pyb.Pin('SW1', pyb.Pin.IN)
+    sw1.init(pyb.Pin.IN, pyb.Pin.PULL_UP, af=-1)
 
     while True:
-        
+
         for addr in peripherals:
             central.search_addr    = addr
 
             print("Searching for device with MAC address {}...".format(hexlify(addr)))
-            
+
             central.scan()
             print("Trying to connect to device with MAC address {}...".format(hexlify(addr)))
-            
+
             conn_result = central.connect(ADDR_TYPE_PUBLIC, addr)
             print("connect() = ", conn_result)
-            
+
             # capture receive events
             central.on_notify(on_receipt)
 
             t0 = time.time()
+            current_sw1 = 1
 
-            while(True):
-                if (int(time.time()-t0) >= _CONNECTION_INTERVAL_SEC):
-                    break
+            while int(time.time() - t0) < _CONNECTION_INTERVAL_SEC:
                 # when button SW1 is pressed on Central board, force the change of the LED state on the Peripheral board
-                sw1 = pyb.Pin('SW1', pyb.Pin.IN)
-                sw1.init(pyb.Pin.IN, pyb.Pin.PULL_UP, af=-1)
-                current_sw1 = 1
                 sw1_value = sw1.value()
                 if sw1_value != current_sw1:
                     if sw1_value == 0: # user button SW1 is pressed
-                        command = "change LED state"
                         try:
-                            central.write(command)
+                            central.write("change LED state")
                             print("sending command: change LED state")
                         except:
                             print("Failed to send command")
-                    current_sw1 = sw1_value  
+                current_sw1 = sw1_value
+                # yield so notifications and acks are serviced while polling
+                await asyncio.sleep_ms(50)
 
             central.disconnect()
 
-            if central.wait_for_connection(False, 3000):
+            if await _wait_for_state(False, 3000):
                 print("Disconnected")
             else:
                 print("Disconnect failed (timeout)!")
                 central._reset()
-            
+
         print("end of the polling cycle : sleeping 20s")
-    
-        time.sleep(20)
+
+        await asyncio.sleep(20)
+
+def demo():
+    asyncio.run(main())
 
 if __name__ == "__main__":
     demo()
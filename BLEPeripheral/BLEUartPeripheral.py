@@ -7,10 +7,16 @@
 
 _MY_NAME = "ID000001"
 
+# set to 1 for verbose BLE event tracing; with const(0) the compiler folds
+# the gated prints out of the event handler entirely
+_DEBUG = const(0)
+
 import bluetooth # BLE native library for uPython
-from ble_advertising import advertising_payload # for the advertising frames
 from binascii import hexlify # data conversion lib
 import pyb
+import struct
+import time
+import uasyncio as asyncio
 
 # constants for the BLE UART service
 _IRQ_CENTRAL_CONNECT = const(1)
@@ -37,13 +43,35 @@ _UART_SERVICE = (
 	(_UART_TX, _UART_RX),
 )
 
+# advertising payload, built once at import: flags (LE general discoverable,
+# BR/EDR unsupported), complete local name, complete 128-bit UART service UUID
+# (little-endian). Name and service are fixed, so there is no need to run the
+# generic advertising_payload() encoder at every boot.
+_ADV_PAYLOAD = (
+	b'\x02\x01\x06'
+	+ bytes((len(_MY_NAME) + 1, 0x09)) + _MY_NAME.encode()
+	+ b'\x11\x07\x9e\xca\xdc\x24\x0e\xe5\xa9\xe0\x93\xf3\xa3\xb5\x01\x00\x40\x6e'
+)
+
 # max bytes for messages
 _MAX_NB_BYTES = const(128)
 
+# RX ring buffer size (power of two so indices can wrap with a mask)
+_RX_BUFFER_SIZE = const(512)
+_RX_BUFFER_MASK = const(511)
+
+# minimum spacing between notifications (ms); writes in between only refresh
+# the characteristic value
+_NOTIFY_MIN_INTERVAL_MS = const(100)
+
+# header byte of the binary sample frame: <header, temp(int8), humi(uint8),
+# illum clamped to uint8> — 4 bytes on air instead of up to 11 of ASCII
+_FRAME_SAMPLE = const(0x01)
+
 class BLEperipheral:
 
 	# initialization
-	def __init__(self, ble, name=_MY_NAME, charbuf=_MAX_NB_BYTES):
+	def __init__(self, ble, charbuf=_MAX_NB_BYTES):
 		self._ble = ble
 		self._ble.active(True)
 		self._ble.irq(self._irq)
@@ -52,19 +80,32 @@ class BLEperipheral:
 		# service registration
 		((self._tx_handle, self._rx_handle),) = self._ble.gatts_register_services((_UART_SERVICE,))
 		
-		# preparing buffers
+		# preparing buffers (gatts_set_buffer already leaves them empty, no
+		# need to pre-write zero-filled placeholders into TX/RX)
 		self._ble.gatts_set_buffer(self._tx_handle, charbuf, True)
 		self._ble.gatts_set_buffer(self._rx_handle, charbuf, True)
-		
-		self._ble.gatts_write(self._tx_handle, bytes(charbuf))
-		self._ble.gatts_write(self._rx_handle, bytes(charbuf))
-		
-		self._connections = set()
-		self._rx_buffer = bytearray()
+
+		# exactly one central can be connected at a time, so track its handle
+		# as a plain int (-1 when idle) rather than iterating a set per notify
+		self._conn_handle = -1
 		self._handler = None
+		# seed relative to the current tick count: a literal 0 can sit up to
+		# half the ticks_ms period in the future and would suppress every
+		# notify for days if a central connects late in the period
+		self._last_notify = time.ticks_add(time.ticks_ms(), -_NOTIFY_MIN_INTERVAL_MS)
+		self._notify_deferred = False
+
+		# preallocated RX ring buffer: head/tail are free-running counters,
+		# masked on access, so append/consume never reallocate
+		self._rx_buffer = bytearray(_RX_BUFFER_SIZE)
+		self._rx_head = 0
+		self._rx_tail = 0
+		# length of each buffered GATT write, so read() can hand messages
+		# back one per call even when several arrive before the reader runs
+		self._rx_chunks = []
 
 		# advertising
-		self._payload = advertising_payload(name=name, services=[_UART_UUID])
+		self._payload = _ADV_PAYLOAD
 		self._advertise()
 		
 		# view the MAC addr
@@ -82,15 +123,21 @@ class BLEperipheral:
 		# if a central connects
 		if event == _IRQ_CENTRAL_CONNECT:
 			conn_handle, _, _ = data
-			self._connections.add(conn_handle)
-			print("New connection", conn_handle)
+			self._conn_handle = conn_handle
+			# stop advertising while connected: gap_advertise does not
+			# auto-stop on every port, and each advertising event costs a
+			# beacon on three channels that contends with the GATT traffic
+			self._ble.gap_advertise(None)
+			if _DEBUG:
+				print("New connection", conn_handle)
 
 		# if a central disconnects
 		elif event == _IRQ_CENTRAL_DISCONNECT:
 			conn_handle, _, _ = data
-			print("Disconnected", conn_handle)
-			if conn_handle in self._connections:
-				self._connections.remove(conn_handle)
+			if _DEBUG:
+				print("Disconnected", conn_handle)
+			if conn_handle == self._conn_handle:
+				self._conn_handle = -1
 			# restarts advertising to allow new connections
 			self._advertise()
 
@@ -98,37 +145,92 @@ class BLEperipheral:
 		# (management of reception events from the central)
 		elif event == _IRQ_GATTS_WRITE:
 			conn_handle, value_handle = data
-			if conn_handle in self._connections and value_handle == self._rx_handle:
-				self._rx_buffer += self._ble.gatts_read(self._rx_handle)
+			if conn_handle == self._conn_handle and value_handle == self._rx_handle:
+				chunk = self._ble.gatts_read(self._rx_handle)
+				n = len(chunk)
+				# drop what does not fit instead of overwriting unread data
+				free = _RX_BUFFER_SIZE - (self._rx_tail - self._rx_head)
+				if n > free:
+					n = free
+				if n:
+					mv = memoryview(self._rx_buffer)
+					i = self._rx_tail & _RX_BUFFER_MASK
+					first = _RX_BUFFER_SIZE - i
+					if first > n:
+						first = n
+					mv[i:i + first] = chunk[0:first]
+					if n > first:
+						mv[0:n - first] = chunk[first:n]
+					self._rx_tail += n
+					self._rx_chunks.append(n)
 				if self._handler:
 					self._handler()
 
 		# payload size change event
 		elif event == _IRQ_MTU_EXCHANGED:
-			print("The maximum message size is now " + str(_MAX_NB_BYTES) + " bytes")
+			if _DEBUG:
+				print("The maximum message size is now " + str(_MAX_NB_BYTES) + " bytes")
 
 	# check if there are messages waiting to be read in RX
 	def any(self):
-		return len(self._rx_buffer)
+		return self._rx_tail - self._rx_head
 
-	# print characters received in RX
+	# print characters received in RX; without sz, returns exactly one
+	# central message (one GATT write) to preserve message framing, an
+	# explicit sz reads that many raw bytes instead
 	def read(self, sz=None):
+		avail = self._rx_tail - self._rx_head
 		if not sz:
-			sz = len(self._rx_buffer)
-		result = self._rx_buffer[0:sz]
-		self._rx_buffer = self._rx_buffer[sz:]
+			sz = self._rx_chunks.pop(0) if self._rx_chunks else avail
+		elif self._rx_chunks:
+			# raw read: the frame accounting no longer matches the stream
+			self._rx_chunks.clear()
+		if sz > avail:
+			sz = avail
+		mv = memoryview(self._rx_buffer)
+		i = self._rx_head & _RX_BUFFER_MASK
+		first = _RX_BUFFER_SIZE - i
+		if first >= sz:
+			result = bytes(mv[i:i + sz])
+		else:
+			result = bytes(mv[i:]) + bytes(mv[0:sz - first])
+		self._rx_head += sz
 		return result
 
 	# writes in TX a message to the attention of the central
 	def write(self, data):
-		for conn_handle in self._connections:
-			self._ble.gatts_notify(conn_handle, self._tx_handle, data)
+		# always refresh the characteristic value so the newest sample is the
+		# one that goes over the air, but rate-limit the notifications
+		# themselves: ubluetooth has no notify-complete event, and under
+		# back-pressure the stack would queue a FIFO of stale values
+		self._ble.gatts_write(self._tx_handle, data)
+		if self._conn_handle < 0:
+			return
+		now = time.ticks_ms()
+		if time.ticks_diff(now, self._last_notify) >= _NOTIFY_MIN_INTERVAL_MS:
+			self._last_notify = now
+			# no data argument: notify the current characteristic value
+			self._ble.gatts_notify(self._conn_handle, self._tx_handle)
+		elif not self._notify_deferred:
+			# suppressed: schedule a flush of the coalesced value once the
+			# window closes, so the last write is still delivered (e.g. the
+			# LED state message sent right after a sample)
+			self._notify_deferred = True
+			asyncio.create_task(self._flush_notify())
+
+	# deferred notification of the latest characteristic value
+	async def _flush_notify(self):
+		await asyncio.sleep_ms(_NOTIFY_MIN_INTERVAL_MS)
+		self._notify_deferred = False
+		if self._conn_handle >= 0:
+			self._last_notify = time.ticks_ms()
+			self._ble.gatts_notify(self._conn_handle, self._tx_handle)
 
 	# close the connection
 	def close(self):
-		for conn_handle in self._connections:
-			self._ble.gap_disconnect(conn_handle)
-		self._connections.clear()
+		if self._conn_handle >= 0:
+			self._ble.gap_disconnect(self._conn_handle)
+			self._conn_handle = -1
 
 	# to start advertising, specify that a Central can connect to the device
 	def _advertise(self, interval_us=500000):
@@ -136,36 +238,42 @@ class BLEperipheral:
 
 	# is the device connected to a central
 	def is_connected(self):
-		return len(self._connections) > 0
+		return self._conn_handle >= 0
+
+
+# precomputed state messages, so the sample loop does not allocate fresh
+# strings on every tick (heap churn triggers GC pauses that add jitter to
+# BLE event servicing)
+_LED_ON_MSG = ("New state of Peripheral " + _MY_NAME + ", LED was turned ON").encode()
+_LED_OFF_MSG = ("New state of Peripheral " + _MY_NAME + ", LED was turned OFF").encode()
+
+
+# LED intensity per lux value below 40: ten entries each of 255, 180, 120 and
+# 60, indexed directly by the reading (one lookup instead of a comparison
+# ladder; intensity ranges between 0 (off) and 255 (full on))
+_LUX_INTENSITY = b'\xff' * 10 + b'\xb4' * 10 + b'\x78' * 10 + b'\x3c' * 10
+
+# single LED object built at import: pyb.LED(3) returns a fresh wrapper on
+# every call, and change_led_state / on_rx run once per tick or per message
+_LED = pyb.LED(3)
 
 
 # function to manage the led state
 def change_led_state(lux): # we consider 50 lux as the threshold
-	led1 = pyb.LED(3)
 	if lux < 50:
-		led1.on() # turn ON the LED
-		if lux < 10:
-			led1.intensity(255)  # intensity ranges between 0 (off) and 255 (full on)
-		elif lux >= 10 and lux < 20:
-			led1.intensity(180) 
-		elif lux >= 20 and lux < 30:
-			led1.intensity(120) 
-		elif lux >= 30 and lux < 40:
-			led1.intensity(60) 
+		_LED.on() # turn ON the LED
+		if lux < 40:
+			# negative readings clamp to the brightest band
+			_LED.intensity(_LUX_INTENSITY[lux if lux > 0 else 0])
 		return True
-	elif lux >= 40:
-		led1.off() # turn OFF the LED
-		return False
-	else: 
-		print("ERROR, unknown value read")
+	_LED.off() # turn OFF the LED
+	return False
 
 
 ###### MAIN PROGRAM ######
 def demo():
-	
-	print("BLE peripheral : %s" %_MY_NAME) 
 
-	import time # to introduce delays
+	print("BLE peripheral : %s" %_MY_NAME)
 
 	print("Misure simulate")
 	import random # to generate psueudo-random values
@@ -174,22 +282,26 @@ def demo():
 	ble = bluetooth.BLE()
 	uart = BLEperipheral(ble)
 
-	# handler for rx event
-	def on_rx():
-		message = uart.read().decode().strip()
-		print("data received from Central : ", message)
-		if (message == "change LED state"):
-			if(pyb.LED(3).on()):
-				pyb.LED(3).off()
-				print("Central command received: turning LED off")
-			else:
-				pyb.LED(3).on("Central command received: turning LED ON")
-
-	# asynchronous rx of data
-	uart.irq(handler=on_rx)
-
-	# simulate_task
-	try:
+	# set from BLE event context, awaited by rx_task: commands are handled
+	# in task context instead of inside the event callback
+	rx_flag = asyncio.ThreadSafeFlag()
+	uart.irq(handler=rx_flag.set)
+
+	# handler for rx events, runs as its own task
+	async def rx_task():
+		while True:
+			await rx_flag.wait()
+			while uart.any():
+				message = uart.read().decode().strip()
+				print("data received from Central : ", message)
+				if (message == "change LED state"):
+					# LED.on() returns None, so the old on()/off() branching
+					# never toggled anything; toggle() flips the state directly
+					_LED.toggle()
+					print("Central command received: LED state changed")
+
+	# periodic generation and tx of the simulated measurements
+	async def sample_task():
 		led_state = False # OFF
 
 		while True:
@@ -200,41 +312,40 @@ def demo():
 
 			new_state = change_led_state(illum)
 
-			# conversions to strings
-			s_temp = str(temp)
-			s_humi = str(humi)
-			s_illum = str(illum)
-
 			# visualization on the serial port of the USB USER
-			print("temperature : " + s_temp + " °C, humidity : " + s_humi + " %, illuminance : " + s_illum + " lux")
+			print("temperature : %d °C, humidity : %d %%, illuminance : %d lux" % (temp, humi, illum))
 
 			if uart.is_connected():
 
-				# data concatenation
-				data = s_temp + "|" + s_humi + "|" + s_illum
+				# pack the sample into a 4-byte binary frame: far fewer bytes
+				# on air than the old "temp|humi|illum" ASCII string
+				data = struct.pack('<BbBB', _FRAME_SAMPLE, temp, humi, illum)
 
 				# tx to Central
 				uart.write(data)
 
-				print("data sent to Central : " + data)
+				print("data sent to Central : %d|%d|%d" % (temp, humi, illum))
 
 				# if the light state changes, inform the Central
 				if (led_state != new_state):
-					if (new_state):
-						data = "New state of Peripheral %s, LED was turned ON" %_MY_NAME
-					else:
-						data = "New state of Peripheral %s, LED was turned OFF" %_MY_NAME
+					data = _LED_ON_MSG if new_state else _LED_OFF_MSG
 					uart.write(data)
 					led_state = new_state
 
-				print("data sent to Central : " + data)
+					print("data sent to Central : ", data.decode())
 
-			# temporization: 5 seconds
-			time.sleep_ms(5000)
+			# temporization: 5 seconds, without blocking rx_task
+			await asyncio.sleep_ms(5000)
+
+	async def main():
+		asyncio.create_task(rx_task())
+		await sample_task()
 
 	# error handler
+	try:
+		asyncio.run(main())
 	except KeyboardInterrupt:
-		pass 
+		pass
 
 	# close connection
 	uart.close()